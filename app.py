@@ -10,20 +10,33 @@ from src.data_upload import S3Uploader
 from src.data_extraction import PDFTextractProcessor
 import boto3
 import time
+import hashlib
+from fastapi.concurrency import run_in_threadpool
 from src.prompt import PromptBuilder
 from src.llm import LLMCaller
+from src.pipeline import Pipeline, Stage
+from src.s3_index import S3ListingIndex
 from utils.load_json import load_json
+from utils.page_store import load_pages, query_keywords
 from utils.save_json import save_to_file
 from utils.save_prompt import save_prompt_to_file
 from utils.combine_json import final_json
+from utils.single_flight import AsyncSingleFlight
 
 app = FastAPI()
 
-uploader = S3Uploader(bucket_name="plcapital-dataextraction")
-extractor = PDFTextractProcessor(bucket_name="plcapital-dataextraction")
+# PDFs with more pages than this are split and OCR'd in parallel shards
+TEXTRACT_SHARD_SIZE = 20
+
 s3_client = boto3.client("s3", region_name="ap-south-1")
-prompt_builder = PromptBuilder()
+s3_index = S3ListingIndex(bucket_name="plcapital-dataextraction", s3_client=s3_client)
+uploader = S3Uploader(bucket_name="plcapital-dataextraction", index=s3_index)
+extractor = PDFTextractProcessor(bucket_name="plcapital-dataextraction", shard_size=TEXTRACT_SHARD_SIZE, index=s3_index)
+prompt_builder = PromptBuilder(layout="prefix_cache")
 llm = LLMCaller()
+# Coalesced on the event loop: callers joining in-flight work await it without holding a thread
+session_flight = AsyncSingleFlight(name="session")
+upload_flight = AsyncSingleFlight(name="upload")
 
 # Temp storage base path
 BASE_TEMP_DIR = os.path.join(tempfile.gettempdir(), "pdf_uploads")
@@ -31,13 +44,6 @@ BASE_TEMP_DIR = os.path.join(tempfile.gettempdir(), "pdf_uploads")
 def get_safe_filename(filename: str) -> str:
     return os.path.basename(filename).replace(" ", "_")
 
-def s3_key_exists(bucket: str, key: str) -> bool:
-    try:
-        s3_client.head_object(Bucket=bucket, Key=key)
-        return True
-    except s3_client.exceptions.ClientError:
-        return False
-    
 # def cleanup_session_files(session_id: str):
 #     try:
 #         # Find any extracted json files in /tmp that belong to this session
@@ -54,26 +60,11 @@ def s3_key_exists(bucket: str, key: str) -> bool:
 #         print(f"Cleanup failed for session {session_id}: {e}")
 
 
-@app.post("/upload-pdf")
-async def upload_pdf(
-    company_name: str = Form(...),
-    year: str = Form(...),
-    qtr: str = Form(...),
-    file_type: str = Form(...),  # "BO" or "IP"
-    pdf_file: UploadFile = File(...),
-    # session_id: Optional[str] = Form(None)
-):
-    # Always use a deterministic session id: company_year_qtr
-    session_id = f"{company_name}_{year}_{qtr}".lower().replace(" ", "_")
-
-    # Create folder: temp/session_id/file_type/
-    temp_dir = os.path.join(BASE_TEMP_DIR, session_id, file_type)
-    os.makedirs(temp_dir, exist_ok=True)
-
+def _upload_document(company_name, year, qtr, file_type, temp_dir, safe_filename, content):
     # Save locally
-    local_pdf_path = os.path.join(temp_dir, get_safe_filename(pdf_file.filename))
+    local_pdf_path = os.path.join(temp_dir, safe_filename)
     with open(local_pdf_path, "wb") as f:
-        f.write(await pdf_file.read())
+        f.write(content)
 
     # Upload to S3 immediately using your uploader
     s3_uri = uploader.upload_single_pdf(
@@ -92,6 +83,35 @@ async def upload_pdf(
     except Exception as e:
         print(f"Cleanup failed: {e}")
 
+    return s3_uri
+
+
+@app.post("/upload-pdf")
+async def upload_pdf(
+    company_name: str = Form(...),
+    year: str = Form(...),
+    qtr: str = Form(...),
+    file_type: str = Form(...),  # "BO" or "IP"
+    pdf_file: UploadFile = File(...),
+    # session_id: Optional[str] = Form(None)
+):
+    # Always use a deterministic session id: company_year_qtr
+    session_id = f"{company_name}_{year}_{qtr}".lower().replace(" ", "_")
+
+    # Create folder: temp/session_id/file_type/
+    temp_dir = os.path.join(BASE_TEMP_DIR, session_id, file_type)
+    os.makedirs(temp_dir, exist_ok=True)
+
+    content = await pdf_file.read()
+    safe_filename = get_safe_filename(pdf_file.filename)
+
+    # Identical uploads of the same document attach to the one already running
+    upload_key = (session_id, file_type.upper(), safe_filename, hashlib.sha256(content).hexdigest())
+    s3_uri = await upload_flight.do(
+        upload_key, run_in_threadpool, _upload_document,
+        company_name, year, qtr, file_type, temp_dir, safe_filename, content
+    )
+
     return JSONResponse({
         "status": "success",
         "session_id": session_id,
@@ -99,6 +119,82 @@ async def upload_pdf(
         "s3_uri": s3_uri
     })
 
+def _run_session_pipeline(company_name, qtr, table_name, bo_key, ip_key, boardoutcome_terms, investor_presentation_terms):
+    # Extraction -> prompt build -> LLM -> merge run as a pipeline, so one document
+    # can be in the LLM stage while the other is still in OCR.
+    documents = [
+        {"category": "Board Outcome", "s3_key": bo_key, "terms": boardoutcome_terms},
+        {"category": "Investor Presentation", "s3_key": ip_key, "terms": investor_presentation_terms},
+    ]
+
+    def extraction_stage(doc):
+        return {**doc, "json_file": extractor.run_textract_with_cache(doc["s3_key"])}
+
+    def prompt_stage(doc):
+        # The prefix-cache layout needs one document block for every query on this document,
+        # so it gets all pages; otherwise only pages mentioning the terms / results table are used
+        keywords = None if prompt_builder.layout == "prefix_cache" else query_keywords(table_name, doc["terms"])
+        pdf_data = load_pages(doc["json_file"], keywords=keywords)
+        prompt = prompt_builder.build_prompt(table_name=table_name, extracted_data=pdf_data, terms=doc["terms"])
+        filename = os.path.splitext(os.path.basename(doc["json_file"]))[0] + "_prompt.txt"
+        print(f"Cacheable prefix for {filename}: {prompt_builder.cacheable_prefix_length(pdf_data)} of {len(prompt)} chars")
+        print(f"Prompt Generated for: {doc['json_file']}")
+        return {**doc, "pdf_data": pdf_data, "prompt": prompt, "filename": filename}
+
+    def llm_stage(doc):
+        # Small model first; only unresolved terms are re-asked to the large model
+        response = llm.cascade_call(
+            lambda terms: prompt_builder.build_prompt(table_name=table_name, extracted_data=doc["pdf_data"], terms=terms),
+            doc["terms"],
+            prompt=doc["prompt"]
+        )
+        time.sleep(5)
+        return {**doc, "response": response}
+
+    board_data_map = {}
+    investor_data_map = {}
+
+    def merge_stage(doc):
+        data_map = board_data_map if doc["category"] == "Board Outcome" else investor_data_map
+        data_map[doc["filename"]] = doc["response"] if doc["response"] else {}
+        return doc["filename"]
+
+    _, errors = Pipeline(
+        stages=[
+            Stage("extraction", extraction_stage, workers=2),
+            Stage("prompt", prompt_stage, workers=1),
+            Stage("llm", llm_stage, workers=2),
+            Stage("merge", merge_stage, workers=1),
+        ]
+    ).run(documents)
+
+    # A document that could not be extracted fails the whole session (reported as a 500)
+    for stage_error in errors:
+        if stage_error.stage == "extraction":
+            raise stage_error.error
+
+    # The PDFs can have any filename, so the quarter comes from the request, not the filenames
+    final_output_path = final_json(board_data_map, investor_data_map, company_name, quarter=qtr)
+
+    final_output = load_json(final_output_path)
+
+    if isinstance(final_output, dict):
+        # Single dictionary
+        final_output_string = "; ".join([f"{key}: {value}" for key, value in final_output.items()])
+    elif isinstance(final_output, list) and all(isinstance(item, dict) for item in final_output):
+        # List of dictionaries
+        all_items = []
+        for item in final_output:
+            all_items.extend([f"{key}: {value}" for key, value in item.items()])
+        final_output_string = "; ".join(all_items)
+    else:
+        # Anything else (None, empty, unexpected format)
+        final_output_string = "No data extracted"
+
+    print(final_output_string)
+    return final_output_string
+
+
 @app.post("/process-session")
 async def process_session(
     company_name: str = Form(...),
@@ -111,16 +207,16 @@ async def process_session(
     # session id from company/year/qtr
     session_id = f"{company_name}_{year}_{qtr}"
     
-    # Expected S3 paths (adjust if uploader uses different folder structure)
-    bo_key = f"{company_name.upper()}/{year.upper()}/{qtr.upper()}/BOARD_OUTCOME/BOARD_OUTCOME_{year.upper()}{qtr.upper()}.PDF"
-    ip_key = f"{company_name.upper()}/{year.upper()}/{qtr.upper()}/INVESTOR_PRESENTATION/INVESTOR_PRESENTATION_{year.upper()}{qtr.upper()}.PDF"
+    # Look up the PDFs from one listing of COMPANY/YEAR/QUARTER/ (any filename in the category folder)
+    bo_key = s3_index.find_pdf(company_name, year, qtr, category="Board Outcome")
+    ip_key = s3_index.find_pdf(company_name, year, qtr, category="Investor Presentation")
 
     print(bo_key)
     print(ip_key)
 
     # Check file existence
-    bo_exists = s3_key_exists(bucket="plcapital-dataextraction", key=bo_key)
-    ip_exists = s3_key_exists(bucket="plcapital-dataextraction", key=ip_key)
+    bo_exists = bo_key is not None
+    ip_exists = ip_key is not None
 
 
     # if bo_exists and ip_exists:
@@ -138,70 +234,16 @@ async def process_session(
             }
         }, status_code=400)
 
-    # Both files exist → Run processing pipeline
+    # Both files exist → Run processing pipeline.
+    # Callers asking for the same session with the same inputs share one run.
+    flight_key = (session_id.lower(), table_name, boardoutcome_terms, investor_presentation_terms)
     try:
-        # Step 1: Data Extraction
-        # bo_data = extract_data(f"s3://{BUCKET_NAME}/{bo_key}", boardoutcome_terms)
-        # ip_data = extract_data(f"s3://{BUCKET_NAME}/{ip_key}", investor_presentation_terms)
-
-        extracted_bo_data_path = [extractor.run_textract_with_cache(bo_key)]
-        extracted_ip_data_path = [extractor.run_textract_with_cache(ip_key)]
-
-        board_data_map = {}
-        for json_file in extracted_bo_data_path:
-            try:
-                pdf_data = load_json(json_file)
-                prompt = prompt_builder.build_prompt(table_name= table_name, extracted_data=pdf_data, terms=boardoutcome_terms)
-                filename = os.path.splitext(os.path.basename(json_file))[0] + "_prompt.txt"
-                print(f"Prompt Generated for: {json_file}")
-                # prompt_path = save_prompt_to_file(prompt, filename, company_name, year, qtr, category="Board Outcome")
-
-                response = llm.llm_call(prompt)
-                board_data_map[filename] = response if response else {}
-                time.sleep(5)
-            except Exception as e:
-                print(f"Error processing {json_file}: {e}")
-
-
-        investor_data_map = {}
-        for json_file in extracted_ip_data_path:
-            try:
-                pdf_data = load_json(json_file)
-                prompt = prompt_builder.build_prompt(table_name=table_name, extracted_data=pdf_data, terms=investor_presentation_terms)
-                filename = os.path.splitext(os.path.basename(json_file))[0] + "_prompt.txt"
-                print(f"Prompt Generated for: {json_file}")
-                # prompt_path = save_prompt_to_file(prompt, filename, company_name, year, qtr, category="Investor Presentation")
-
-                response = llm.llm_call(prompt)
-                investor_data_map[filename] = response if response else {}
-                time.sleep(5)
-            except Exception as e:
-                print(f"Error processing {json_file}: {e}")
-
-        final_output_path = final_json(board_data_map, investor_data_map, company_name)
-
-        final_output = load_json(final_output_path)
-
-        if isinstance(final_output, dict):
-            # Single dictionary
-            final_output_string = "; ".join([f"{key}: {value}" for key, value in final_output.items()])
-        elif isinstance(final_output, list) and all(isinstance(item, dict) for item in final_output):
-            # List of dictionaries
-            all_items = []
-            for item in final_output:
-                all_items.extend([f"{key}: {value}" for key, value in item.items()])
-            final_output_string = "; ".join(all_items)
-        else:
-            # Anything else (None, empty, unexpected format)
-            final_output_string = "No data extracted"
-
-        print(final_output_string)
-        return final_output_string
-
-
-
+        return await session_flight.do(
+            flight_key, run_in_threadpool, _run_session_pipeline,
+            company_name, qtr, table_name, bo_key, ip_key, boardoutcome_terms, investor_presentation_terms
+        )
     except Exception as e:
         return JSONResponse({
             "status": "error",
             "message": f"Processing failed: {str(e)}"
-        }, status_code=500)
\ No newline at end of file
+        }, status_code=500)
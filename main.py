@@ -8,12 +8,23 @@ from src.data_upload import S3Uploader
 from src.data_extraction import PDFTextractProcessor
 from src.prompt import PromptBuilder
 from src.llm import LLMCaller
+from src.pipeline import Pipeline, Stage
+from src.s3_index import S3ListingIndex
 from utils.load_json import load_json
+from utils.page_store import load_pages, query_keywords
 from utils.save_json import save_to_file
 from utils.save_prompt import save_prompt_to_file
 from utils.combine_json import final_json
 
 
+# Workers per pipeline stage and the max documents waiting between stages
+UPLOAD_WORKERS = 2
+EXTRACTION_WORKERS = 4
+PROMPT_WORKERS = 1
+LLM_WORKERS = 2
+PIPELINE_QUEUE_SIZE = 2
+# PDFs with more pages than this are split and OCR'd in parallel shards
+TEXTRACT_SHARD_SIZE = 20
 
 
 def main():
@@ -24,6 +35,7 @@ def main():
     quater = input("Enter the quater (eg.. Q1): ")
     boardoucome_terms = input("Enters the Board Oucome terms: ").split(",")
     invester_terms = input("Enter the Investers terms: ").split(",")
+    table_name = input("Enter the table name (eg.. Consolidated): ").strip()
 
     board_outcome_path = input("Enter the Board Outcome path: ").strip()
     investor_presentation_path = input("Enter the Investor Presentation path: ").strip()
@@ -37,89 +49,99 @@ def main():
     print(investor_presentation_path)
 
     # Initialize Components
-    uploader = S3Uploader(
+    s3_index = S3ListingIndex(
         bucket_name="plcapital-dataextraction"
     )
+    uploader = S3Uploader(
+        bucket_name="plcapital-dataextraction",
+        index=s3_index
+    )
     extractor = PDFTextractProcessor(
-        bucket_name="plcapital-dataextraction"
+        bucket_name="plcapital-dataextraction",
+        shard_size=TEXTRACT_SHARD_SIZE,
+        index=s3_index
     )
-    prompt_builder = PromptBuilder()
+    prompt_builder = PromptBuilder(layout="prefix_cache")
     llm = LLMCaller()
 
 
-    # Uplode File to S3
-
-    if os.path.isfile(board_outcome_path):
-        upload_files_board_outcome = [
-            uploader.upload_single_pdf(company_name=company_name, year=year, quarter=quater, category="Board Outcome", pdf_path=board_outcome_path)
-        ]
-    else:
-        upload_files_board_outcome = uploader.upload_category_folder(category_folder_path=board_outcome_path)
-
-    if os.path.isfile(investor_presentation_path):
-        upload_files_investor_presentations = [
-            uploader.upload_single_pdf(company_name=company_name, year=year, quarter=quater, category="Investor Presentation", pdf_path=investor_presentation_path)
-        ]
-    else:
-        upload_files_investor_presentations = uploader.upload_category_folder(category_folder_path=investor_presentation_path)
-
-
-    print("Board file: ", upload_files_board_outcome)
-    print("Invester file: ", upload_files_investor_presentations)
-
-
-    # Data Extraction
-
-    if os.path.isfile(board_outcome_path):
-        extracted_boardoutcome_data_path = [
-            extractor.run_textract_with_cache(upload_files_board_outcome[0])
-        ]
-    else:
-        extracted_boardoutcome_data_path = extractor.run_textract_with_cache(upload_files_board_outcome)
-
-    if os.path.isfile(investor_presentation_path):
-        extracted_investor_data_path = [
-            extractor.run_textract_with_cache(upload_files_investor_presentations[0])
-        ]
-    else:
-        extracted_investor_data_path = extractor.run_textract_with_cache(upload_files_investor_presentations)
-
-    print("Data Path board outcome: ", extracted_boardoutcome_data_path)
-    print("Data Path investor outcome: ", extracted_investor_data_path)
-
-    
-    # Process Board Outcome
+    # Documents to process: one entry per PDF, tagged with its category and terms
+
+    documents = []
+    for category, path, terms in [
+        ("Board Outcome", board_outcome_path, boardoucome_terms),
+        ("Investor Presentation", investor_presentation_path, invester_terms),
+    ]:
+        if os.path.isfile(path):
+            documents.append({"category": category, "pdf_path": path, "terms": terms, "single": True})
+        elif os.path.isdir(path):
+            for file in os.listdir(path):
+                if file.lower().endswith(".pdf"):
+                    documents.append({"category": category, "pdf_path": os.path.join(path, file), "terms": terms, "single": False})
+        else:
+            print(f"Path not found: {path}")
+
+
+    # Pipeline stages: upload -> extraction cache -> prompt build -> LLM -> merge
+
+    def upload_stage(doc):
+        if doc["single"]:
+            s3_uri = uploader.upload_single_pdf(company_name=company_name, year=year, quarter=quater, category=doc["category"], pdf_path=doc["pdf_path"])
+        else:
+            s3_uri = uploader.upload_pdf_to_s3(doc["pdf_path"])
+        if not s3_uri:
+            raise RuntimeError(f"Upload failed for {doc['pdf_path']}")
+        print(f"{doc['category']} file: {s3_uri}")
+        return {**doc, "s3_uri": s3_uri}
+
+    def extraction_stage(doc):
+        json_file = extractor.run_textract_with_cache(doc["s3_uri"])
+        print(f"Data Path {doc['category']}: {json_file}")
+        return {**doc, "json_file": json_file}
+
+    def prompt_stage(doc):
+        # The prefix-cache layout needs one document block for every query on this document,
+        # so it gets all pages; otherwise only pages mentioning the terms / results table are used
+        keywords = None if prompt_builder.layout == "prefix_cache" else query_keywords(table_name, doc["terms"])
+        pdf_data = load_pages(doc["json_file"], keywords=keywords)
+        prompt = prompt_builder.build_prompt(table_name=table_name, extracted_data=pdf_data, terms=doc["terms"])
+        filename = os.path.splitext(os.path.basename(doc["json_file"]))[0] + "_prompt.txt"
+        print(f"Cacheable prefix for {filename}: {prompt_builder.cacheable_prefix_length(pdf_data)} of {len(prompt)} chars")
+        save_prompt_to_file(prompt, filename, company_name, year, quater, category=doc["category"])
+        return {**doc, "pdf_data": pdf_data, "prompt": prompt, "filename": filename}
+
+    def llm_stage(doc):
+        # Small model first; only unresolved terms are re-asked to the large model
+        response = llm.cascade_call(
+            lambda terms: prompt_builder.build_prompt(table_name=table_name, extracted_data=doc["pdf_data"], terms=terms),
+            doc["terms"],
+            prompt=doc["prompt"]
+        )
+        time.sleep(5)
+        return {**doc, "response": response}
 
     board_data_map = {}
-    for json_file in extracted_boardoutcome_data_path:
-        try:
-            pdf_data = load_json(json_file)
-            prompt = prompt_builder.build_prompt(pdf_data, boardoucome_terms)
-            filename = os.path.splitext(os.path.basename(json_file))[0] + "_prompt.txt"
-            prompt_path = save_prompt_to_file(prompt, filename, company_name, year, quater, category="Board Outcome")
-
-            response = llm.llm_call(prompt)
-            board_data_map[filename] = response if response else {}
-            time.sleep(5)
-        except Exception as e:
-            print(f"Error processing {json_file}: {e}")
-
-    
-    # Process Investor Presentations
-
     investor_data_map = {}
-    for json_file in extracted_investor_data_path:
-        try:
-            pdf_data = load_json(json_file)
-            prompt = prompt_builder.build_prompt(pdf_data, invester_terms)
-            filename = os.path.splitext(os.path.basename(json_file))[0] + "_prompt.txt"
-            prompt_path = save_prompt_to_file(prompt, filename, company_name, year, quater, category="Investor Presentation")
-
-            response = llm.llm_call(prompt)
-            investor_data_map[filename] = response if response else {}
-            time.sleep(5)
-        except Exception as e:
-            print(f"Error processing {json_file}: {e}")
+
+    def merge_stage(doc):
+        data_map = board_data_map if doc["category"] == "Board Outcome" else investor_data_map
+        data_map[doc["filename"]] = doc["response"] if doc["response"] else {}
+        return doc["filename"]
+
+    pipeline = Pipeline(
+        stages=[
+            Stage("upload", upload_stage, workers=UPLOAD_WORKERS),
+            Stage("extraction", extraction_stage, workers=EXTRACTION_WORKERS),
+            Stage("prompt", prompt_stage, workers=PROMPT_WORKERS),
+            Stage("llm", llm_stage, workers=LLM_WORKERS),
+            Stage("merge", merge_stage, workers=1),
+        ],
+        queue_size=PIPELINE_QUEUE_SIZE
+    )
+    processed, errors = pipeline.run(documents)
+    print(f"Processed {len(processed)} of {len(documents)} document(s)")
+    for stage_error in errors:
+        print(f"Failed in {stage_error.stage}: {documents[stage_error.index]['pdf_path']} ({stage_error.error})")
 
     final_output_path = final_json(board_data_map, investor_data_map, company_name)
 
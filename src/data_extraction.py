@@ -1,21 +1,38 @@
 # This file does the data extraction from the pdf using AWS Textract with caching in S3.
 import os
-import json
 import time
+import uuid
+import hashlib
+import tempfile
 import boto3
+import pypdfium2 as pdfium
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 from botocore.exceptions import ClientError
+from utils.page_store import save_pages, build_index, convert_json_to_pages
+from utils.single_flight import SingleFlight
+from src.s3_index import S3ListingIndex
 
 class PDFTextractProcessor:
-    def __init__(self, bucket_name, region="ap-south-1", local_output_base="D:\PL\Extracted Data"):
+    def __init__(self, bucket_name, region="ap-south-1", local_output_base="D:\PL\Extracted Data",
+                 shard_size=None, max_workers=4, max_pages=None, page_keywords=None,
+                 shard_prefix="_textract_shards", index=None):
         self.bucket_name = bucket_name
         self.region = region
         self.local_output_base = local_output_base
+        self.shard_size = shard_size  # Pages per shard; None -> whole document as one job
+        self.max_workers = max_workers
+        self.max_pages = max_pages  # Only OCR the first N pages
+        self.page_keywords = page_keywords  # Only OCR pages whose text layer matches one of these
+        self.shard_prefix = shard_prefix
         self.textract = boto3.client('textract', region_name=region)
         self.s3 = boto3.client('s3', region_name=region)
+        # Existence checks go through prefix listings instead of one head_object per key
+        self.index = index or S3ListingIndex(bucket_name, region=region, s3_client=self.s3)
+        self._inflight = SingleFlight(name="textract")
 
-    def extract_text_from_pdf_s3_async(self, s3_key):
+    def extract_text_from_pdf_s3_async(self, s3_key, page_map=None):
         response = self.textract.start_document_analysis(
             DocumentLocation={'S3Object': {'Bucket': self.bucket_name, 'Name': s3_key}},
             FeatureTypes=["TABLES", "FORMS"]
@@ -53,58 +70,201 @@ class PDFTextractProcessor:
                 text = block["Text"]
                 page_chunks[page_number].append(text)
 
+        # page_map maps the page number inside a shard back to the original page number
         page_text_chunks = [
-            {"page_no": str(page), "content": "\n".join(lines)}
+            {"page_no": str(page_map[page - 1] if page_map else page), "content": "\n".join(lines)}
             for page, lines in sorted(page_chunks.items())
         ]
         return page_text_chunks
 
-    def _json_s3_key(self, s3_uri):
+    def _select_pages(self, pdf):
+        """Return the 1-based page numbers worth sending to Textract."""
+        page_count = len(pdf)
+        pages = list(range(1, page_count + 1))
+        if self.max_pages:
+            pages = pages[:self.max_pages]
+
+        if self.page_keywords:
+            keywords = [k.lower() for k in self.page_keywords]
+            matched = []
+            for page_no in pages:
+                textpage = pdf[page_no - 1].get_textpage()
+                text = textpage.get_text_range().lower()
+                textpage.close()
+                if any(k in text for k in keywords):
+                    matched.append(page_no)
+            # Scanned PDFs have no text layer to match against, keep everything in that case
+            if matched:
+                pages = matched
+            else:
+                print("No pages matched the keywords, keeping all selected pages")
+
+        return pages
+
+    def _upload_shards(self, pdf, pages, shard_dir):
+        """Write each page range as its own PDF and upload it to a temporary S3 key."""
+        shard_size = self.shard_size or max(len(pages), 1)  # Page selection without sharding -> one shard
+        shards = []
+        run_id = uuid.uuid4().hex
+        try:
+            for i in range(0, len(pages), shard_size):
+                shard_pages = pages[i:i + shard_size]
+                shard_pdf = pdfium.PdfDocument.new()
+                shard_pdf.import_pages(pdf, [p - 1 for p in shard_pages])
+                local_path = os.path.join(shard_dir, f"shard_{i // shard_size:04d}.pdf")
+                shard_pdf.save(local_path)
+                shard_pdf.close()
+
+                shard_key = f"{self.shard_prefix}/{run_id}/{os.path.basename(local_path)}"
+                self.s3.upload_file(local_path, self.bucket_name, shard_key)
+                shards.append((shard_key, shard_pages))
+        except Exception:
+            # Don't leave the shards uploaded so far behind under the shard prefix
+            self._delete_shards(shards)
+            raise
+
+        print(f"Uploaded {len(shards)} shard(s) covering {len(pages)} page(s)")
+        return shards
+
+    def extract_text_from_pdf_s3_sharded(self, s3_key):
+        """
+        Split the PDF into page-range shards, OCR them concurrently and
+        stitch the page chunks back together with the original page numbers.
+
+        A document whose selected pages are all of its pages and fit in one shard
+        is sent to Textract under its original key, without re-uploading.
+        """
+        with tempfile.TemporaryDirectory() as shard_dir:
+            local_pdf_path = os.path.join(shard_dir, "source.pdf")
+            self.s3.download_file(self.bucket_name, s3_key, local_pdf_path)
+
+            pdf = pdfium.PdfDocument(local_pdf_path)
+            try:
+                pages = self._select_pages(pdf)
+                whole_document = len(pages) == len(pdf)
+                if whole_document and (not self.shard_size or len(pages) <= self.shard_size):
+                    shards = None
+                else:
+                    shards = self._upload_shards(pdf, pages, shard_dir)
+            finally:
+                pdf.close()
+
+        if shards is None:
+            print(f"{len(pages)} page(s), no sharding needed")
+            return self.extract_text_from_pdf_s3_async(s3_key)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = executor.map(
+                    lambda shard: self.extract_text_from_pdf_s3_async(shard[0], page_map=shard[1]),
+                    shards
+                )
+                page_text_chunks = [chunk for shard_chunks in results for chunk in shard_chunks]
+        finally:
+            self._delete_shards(shards)
+
+        return page_text_chunks
+
+    def _delete_shards(self, shards):
+        for shard_key, _ in shards:
+            try:
+                self.s3.delete_object(Bucket=self.bucket_name, Key=shard_key)
+            except ClientError as e:
+                print(f"Failed to delete shard s3://{self.bucket_name}/{shard_key}: {e}")
+
+    def extract_text(self, s3_key):
+        """Run Textract on the whole document, or shard it when sharding/page selection is enabled."""
+        if self.shard_size or self.max_pages or self.page_keywords:
+            return self.extract_text_from_pdf_s3_sharded(s3_key)
+        return self.extract_text_from_pdf_s3_async(s3_key)
+
+    def _selection_suffix(self):
+        """Tag for partial extractions (max_pages / page_keywords), so they never share the full cache key."""
+        suffix = ""
+        if self.max_pages:
+            suffix += f"__first{self.max_pages}"
+        if self.page_keywords:
+            keywords = ",".join(sorted(k.lower() for k in self.page_keywords))
+            suffix += f"__kw{hashlib.sha1(keywords.encode('utf-8')).hexdigest()[:8]}"
+        return suffix
+
+    def _json_s3_key(self, s3_uri, ext=".jsonl", suffix=""):
         """Generate JSON S3 key based on original PDF S3 path"""
         parsed = urlparse(s3_uri)
         path_parts = parsed.path.strip("/").split("/")  # e.g. ['Company','FY25','Q1','Board Outcome','file.pdf']
         file_stem = os.path.splitext(path_parts[-1])[0]
-        json_key = "/".join(path_parts[:-1] + [f"{file_stem}.json"])
+        json_key = "/".join(path_parts[:-1] + [f"{file_stem}{suffix}{ext}"])
         return json_key
 
-    def _local_json_path(self, s3_uri):
+    def _local_json_path(self, s3_uri, ext=".jsonl", suffix=""):
         """Generate local path to store JSON"""
         parsed = urlparse(s3_uri)
         path_parts = parsed.path.strip("/").split("/")
         file_stem = os.path.splitext(path_parts[-1])[0]
         output_folder = os.path.join(self.local_output_base, *path_parts[:-1])
         os.makedirs(output_folder, exist_ok=True)
-        return os.path.join(output_folder, f"{file_stem}.json")
+        return os.path.join(output_folder, f"{file_stem}{suffix}{ext}")
+
+    def _s3_object_exists(self, key):
+        return self.index.exists(key)
 
     def run_textract_with_cache(self, s3_uri):
         """
-        Check if extracted JSON exists on S3.
-        If yes -> download it locally and return path.
-        If no  -> run Textract, save JSON locally + upload to S3.
+        Check if extracted pages (.jsonl) exist on S3.
+        If yes -> download them locally and return path.
+        If only a legacy .json exists -> download it and convert it to .jsonl.
+        If no  -> run Textract, save pages locally + upload to S3.
+
+        Partial extractions (max_pages / page_keywords) are cached under their own key;
+        a cached full extraction is reused for them when it exists.
+        Concurrent calls for the same document share one run.
         """
-        json_key = self._json_s3_key(s3_uri)
-        local_json_path = self._local_json_path(s3_uri)
+        json_key = self._json_s3_key(s3_uri, suffix=self._selection_suffix())
+        return self._inflight.do((self.bucket_name, json_key), self._run_textract_with_cache, s3_uri)
 
-        # 1. Check if JSON exists in S3
-        try:
-            self.s3.head_object(Bucket=self.bucket_name, Key=json_key)
-            print(f"JSON already exists on S3: s3://{self.bucket_name}/{json_key}")
-            self.s3.download_file(self.bucket_name, json_key, local_json_path)
-            return local_json_path
-        except ClientError:
-            print("JSON not found on S3, running Textract...")
+    def _run_textract_with_cache(self, s3_uri):
+        suffix = self._selection_suffix()
+        json_key = self._json_s3_key(s3_uri, suffix=suffix)
+        local_json_path = self._local_json_path(s3_uri, suffix=suffix)
+
+        # 1. Check if pages exist in S3 (the full extraction also covers a partial request)
+        cached_keys = [(json_key, local_json_path)]
+        if suffix:
+            cached_keys.append((self._json_s3_key(s3_uri), self._local_json_path(s3_uri)))
+        for cached_key, cached_path in cached_keys:
+            if self._s3_object_exists(cached_key):
+                print(f"JSONL already exists on S3: s3://{self.bucket_name}/{cached_key}")
+                self.s3.download_file(self.bucket_name, cached_key, cached_path)
+                build_index(cached_path)
+                return cached_path
+
+        legacy_json_key = self._json_s3_key(s3_uri, ext=".json")
+        if self._s3_object_exists(legacy_json_key):
+            print(f"Legacy JSON exists on S3: s3://{self.bucket_name}/{legacy_json_key}")
+            legacy_json_path = self._local_json_path(s3_uri, ext=".json")
+            self.s3.download_file(self.bucket_name, legacy_json_key, legacy_json_path)
+            full_json_key = self._json_s3_key(s3_uri)
+            full_json_path = convert_json_to_pages(legacy_json_path, self._local_json_path(s3_uri))
+
+            # Store the converted pages so later runs skip the legacy download + conversion
+            self.s3.upload_file(full_json_path, self.bucket_name, full_json_key)
+            self.index.record_write(full_json_key, size=os.path.getsize(full_json_path))
+            print(f"Converted JSONL uploaded to S3: s3://{self.bucket_name}/{full_json_key}")
+            return full_json_path
+
+        print("JSON not found on S3, running Textract...")
 
         # 2. Run Textract
         s3_key = urlparse(s3_uri).path.lstrip("/")
-        extracted = self.extract_text_from_pdf_s3_async(s3_key)
+        extracted = self.extract_text(s3_key)
 
         # 3. Save locally
-        with open(local_json_path, "w", encoding="utf-8") as f:
-            json.dump(extracted, f, indent=4, ensure_ascii=False)
+        save_pages(extracted, local_json_path)
 
         # 4. Upload to S3
         self.s3.upload_file(local_json_path, self.bucket_name, json_key)
-        print(f"JSON uploaded to S3: s3://{self.bucket_name}/{json_key}")
+        self.index.record_write(json_key, size=os.path.getsize(local_json_path))
+        print(f"JSONL uploaded to S3: s3://{self.bucket_name}/{json_key}")
 
         return local_json_path
 
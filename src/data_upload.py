@@ -3,10 +3,11 @@ import os
 import boto3
 
 class S3Uploader:
-    def __init__(self, bucket_name, region="ap-south-1"):
+    def __init__(self, bucket_name, region="ap-south-1", index=None):
         self.bucket_name = bucket_name
         self.region = region
         self.s3 = boto3.client("s3", region_name=region)
+        self.index = index  # Optional S3ListingIndex kept up to date on upload
 
     def upload_pdf_to_s3(self, pdf_path):
         """Uploads a PDF to S3 by inferring company/category from the file path."""
@@ -27,6 +28,8 @@ class S3Uploader:
 
         try:
             self.s3.upload_file(pdf_path, self.bucket_name, s3_key)
+            if self.index:
+                self.index.record_write(s3_key, size=os.path.getsize(pdf_path))
             print(f"✅ Uploaded to {s3_uri}")
             return s3_uri
 
@@ -69,6 +72,8 @@ class S3Uploader:
 
         try:
             self.s3.upload_file(pdf_path, self.bucket_name, s3_key)
+            if self.index:
+                self.index.record_write(s3_key, size=os.path.getsize(pdf_path))
             print(f"✅ Uploaded to {s3_uri}")
             return s3_uri
 
@@ -1,5 +1,7 @@
 # This file call the llm(OpenAI)
 import os
+import re
+import math
 import json
 import openai
 from dotenv import load_dotenv
@@ -9,14 +11,78 @@ load_dotenv()
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Values above this (in millions) are treated as a scaling mistake
+MAX_ABS_VALUE = 1e8
+# Terms that are quantities/ratios and can never be negative
+NON_NEGATIVE_HINTS = ["volume", "capacity", "utilization", "utilisation", "tonnes", "mnt", "headcount"]
+
+
+def parse_terms(terms):
+    """Normalize terms given as a comma separated string, a JSON object/list or a list."""
+    if isinstance(terms, dict):
+        return [str(t).strip() for t in terms.keys() if str(t).strip()]
+    if isinstance(terms, str):
+        try:
+            return parse_terms(json.loads(terms))
+        except (ValueError, TypeError):
+            return [t.strip() for t in terms.split(",") if t.strip()]
+    return [str(t).strip() for t in terms if str(t).strip()]
+
+
+def parse_response(response):
+    """Parse the LLM output into a dict, tolerating ```json fences. Returns None if it is not a JSON object."""
+    if not response:
+        return None
+    text = re.sub(r"^```(?:json)?|```$", "", response.strip()).strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def validate_response(response, terms):
+    """
+    Check an extraction response against the requested terms.
+
+    Returns (values, unresolved):
+    - values:     {term: value} for terms whose value is numeric and plausible
+    - unresolved: terms that are missing, null, non-numeric, non-finite or implausible
+    """
+    terms = parse_terms(terms)
+    data = parse_response(response)
+    if data is None:
+        return {}, terms
+
+    values = {}
+    unresolved = []
+    for term in terms:
+        value = data.get(term)
+        try:
+            number = float(str(value).replace(",", "").strip())
+        except (TypeError, ValueError):
+            unresolved.append(term)
+            continue
+
+        if not math.isfinite(number) or abs(number) > MAX_ABS_VALUE:
+            unresolved.append(term)
+        elif number < 0 and any(hint in term.lower() for hint in NON_NEGATIVE_HINTS):
+            unresolved.append(term)
+        else:
+            values[term] = value
+
+    return values, unresolved
+
+
 class LLMCaller:
-    def __init__(self, model="gpt-5"):  # Default model; change if needed
+    def __init__(self, model="gpt-5", small_model="gpt-5-mini"):  # Default model; change if needed
         self.model = model
+        self.small_model = small_model  # Tried first by cascade_call
 
-    def llm_call(self, prompt):
+    def llm_call(self, prompt, model=None):
         try:
             response = openai.ChatCompletion.create(
-                model=self.model,
+                model=model or self.model,
                 messages=[
                     {
                         "role": "user",
@@ -29,3 +95,31 @@ class LLMCaller:
         except Exception as e:
             print(f"Error during OpenAI API call: {e}")
             return None
+
+    def cascade_call(self, build_prompt, terms, prompt=None):
+        """
+        Send the prompt to the small model first and re-send only the terms that
+        fail validation (or come back null) to the large model.
+
+        build_prompt: callable taking a comma separated terms string and returning a prompt
+        prompt:       optional prebuilt prompt for the full set of terms
+        Returns the merged result as a JSON string (same shape as llm_call).
+
+        Provider prompt caches are per model, so the escalation prompt does not reuse the
+        small-model call's cached prefix; it only hits earlier large-model calls on the document.
+        """
+        terms = parse_terms(terms)
+        if not self.small_model or self.small_model == self.model:
+            return self.llm_call(prompt or build_prompt(",".join(terms)))
+
+        response = self.llm_call(prompt or build_prompt(",".join(terms)), model=self.small_model)
+        values, unresolved = validate_response(response, terms)
+
+        if unresolved:
+            print(f"Escalating {len(unresolved)} of {len(terms)} term(s) to {self.model}: {unresolved}")
+            response = self.llm_call(build_prompt(",".join(unresolved)), model=self.model)
+            data = parse_response(response) or {}
+            for term in unresolved:
+                values[term] = data.get(term)
+
+        return json.dumps({term: values.get(term) for term in terms}, ensure_ascii=False)
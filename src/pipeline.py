@@ -0,0 +1,108 @@
+# This file runs documents through a chain of stages (upload -> extraction -> prompt -> LLM -> merge)
+# with bounded queues in between, so different documents can be in different stages at the same time.
+import queue
+import threading
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn  # Called with the output of the previous stage, returns the input of the next one
+        self.workers = workers
+
+
+class StageError:
+    def __init__(self, stage, index, item, error):
+        self.stage = stage  # Name of the stage that failed
+        self.index = index  # Position of the item in the input
+        self.item = item
+        self.error = error
+
+    def __repr__(self):
+        return f"StageError(stage={self.stage!r}, index={self.index}, error={self.error!r})"
+
+
+class Pipeline:
+    def __init__(self, stages, queue_size=2):
+        """
+        stages:     list of Stage, in order
+        queue_size: max items waiting in front of each stage. A full queue blocks the
+                    stage before it (backpressure), which keeps memory bounded.
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def _worker(self, stage, in_q, out_q, errors, errors_lock):
+        while True:
+            entry = in_q.get()
+            if entry is _DONE:
+                return
+
+            index, item = entry
+            try:
+                result = stage.fn(item)
+            except Exception as e:
+                print(f"Error in stage '{stage.name}' for item {index}: {e}")
+                with errors_lock:
+                    errors.append(StageError(stage.name, index, item, e))
+                continue
+            out_q.put((index, result))
+
+    def run(self, items):
+        """
+        Push items through every stage.
+        Items that fail in any stage are logged and dropped from the outputs.
+
+        Returns (outputs, errors):
+        - outputs: final stage results, in input order
+        - errors:  list of StageError, one per dropped item
+        """
+        errors = []
+        errors_lock = threading.Lock()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        results_q = queue.Queue()
+        queues.append(results_q)
+
+        stage_threads = []
+        for i, stage in enumerate(self.stages):
+            threads = [
+                threading.Thread(
+                    target=self._worker, args=(stage, queues[i], queues[i + 1], errors, errors_lock),
+                    name=f"{stage.name}-{n}", daemon=True
+                )
+                for n in range(stage.workers)
+            ]
+            for t in threads:
+                t.start()
+            stage_threads.append(threads)
+
+        def feed():
+            for index, item in enumerate(items):
+                queues[0].put((index, item))
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_DONE)
+
+        def shutdown():
+            # Once every worker of a stage has exited, nothing more will reach the next stage
+            for i, threads in enumerate(stage_threads):
+                for t in threads:
+                    t.join()
+                next_workers = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+                for _ in range(next_workers):
+                    queues[i + 1].put(_DONE)
+
+        threading.Thread(target=feed, name="pipeline-feed", daemon=True).start()
+        threading.Thread(target=shutdown, name="pipeline-shutdown", daemon=True).start()
+
+        outputs = {}
+        while True:
+            entry = results_q.get()
+            if entry is _DONE:
+                break
+            index, result = entry
+            outputs[index] = result
+
+        errors.sort(key=lambda e: e.index)
+        return [outputs[index] for index in sorted(outputs)], errors
@@ -1,8 +1,27 @@
 from langchain.prompts import PromptTemplate
 
 
+LAYOUTS = ("legacy", "prefix_cache")
+
+
 class PromptBuilder:
-    def __init__(self):
+    def __init__(self, layout="legacy"):
+        """
+        layout:
+        - "legacy":       instructions (with the table name inside), document, terms
+        - "prefix_cache": static instructions, then the document, then the per-query part
+                          (table name + terms), so repeated queries on one document share
+                          a long identical prefix and hit provider-side prompt caching.
+                          Provider caches are per model: in LLMCaller.cascade_call the
+                          small-model call and the large-model escalation don't share a cache
+                          entry; each reuses the prefix only with earlier calls to the same model.
+                          extracted_data must be the same page set for every query on the
+                          document (no per-query page selection) for the prefix to match.
+        """
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown prompt layout: {layout}. Expected one of {LAYOUTS}")
+        self.layout = layout
+
         self.template = """
         Instructions:
     ------------------------------------
@@ -74,5 +93,44 @@ class PromptBuilder:
 
         self.prompt = PromptTemplate.from_template(self.template)
 
+        # Same instructions without any per-query variable, so they are byte-identical across calls
+        instructions = self.template.split("    Extracted Data:")[0]
+        self.static_instructions = instructions.replace(
+            'the table titled "{table_name} Financial Results"',
+            'the table titled "<Table Name> Financial Results", where <Table Name> is given in the Query section at the end'
+        ).replace(
+            "The keys of the JSON object must be the terms provided.",
+            "The keys of the JSON object must be the terms provided in the Query section."
+        )
+
+    def _document_block(self, extracted_data) -> str:
+        return f"""    Extracted Data:
+    ------------------------------------
+    {extracted_data}
+    ------------------------------------
+
+"""
+
+    def cacheable_prefix(self, extracted_data) -> str:
+        """Static instructions + document block: identical for every query about this document,
+        as long as every query passes the same extracted_data."""
+        if self.layout != "prefix_cache":
+            return ""
+        return self.static_instructions + self._document_block(extracted_data)
+
+    def cacheable_prefix_length(self, extracted_data) -> int:
+        """Length (in characters) of the prompt prefix shared by every query about this document (per model)."""
+        return len(self.cacheable_prefix(extracted_data))
+
     def build_prompt(self, table_name: str, extracted_data: str, terms: str) -> str:
+        if self.layout == "prefix_cache":
+            return self.cacheable_prefix(extracted_data) + f"""
+    Query:
+    ------------------------------------
+    Table Name: {table_name}
+
+    Terms:
+    {terms}
+    ------------------------------------
+    """
         return self.prompt.format(table_name=table_name, extracted_data=extracted_data, terms=terms)
@@ -0,0 +1,134 @@
+# This file keeps an in-memory index of S3 objects built from prefix listings,
+# so existence checks don't need one head_object call per key.
+import os
+import time
+import threading
+import boto3
+from datetime import datetime, timezone
+from utils.single_flight import SingleFlight
+
+
+class S3ListingIndex:
+    def __init__(self, bucket_name, region="ap-south-1", s3_client=None, ttl_seconds=30):
+        self.bucket_name = bucket_name
+        self.region = region
+        self.s3 = s3_client or boto3.client("s3", region_name=region)
+        self.ttl_seconds = ttl_seconds  # A listed prefix is listed again after this long
+        self._lock = threading.Lock()
+        self._objects = {}  # key -> {"etag": ..., "size": ..., "last_modified": ...}
+        self._listed_prefixes = {}  # prefix -> time.monotonic() of the last listing
+        self._refresh_flight = SingleFlight(name="s3-listing")  # One listing per prefix at a time
+
+    @staticmethod
+    def _prefix_for(key):
+        """
+        COMPANY/YEAR/QUARTER/ for keys in that layout, otherwise the key's folder.
+        A key without a folder is its own prefix, so it never lists the whole bucket.
+        """
+        if key.endswith("/") and key.count("/") <= 3:
+            return key
+        parts = key.strip("/").split("/")
+        if len(parts) > 3:
+            return "/".join(parts[:3]) + "/"
+        return os.path.dirname(key.strip("/")) + "/" if len(parts) > 1 else key
+
+    def _is_fresh(self, key):
+        now = time.monotonic()
+        return any(
+            key.startswith(prefix) and now - listed_at < self.ttl_seconds
+            for prefix, listed_at in self._listed_prefixes.items()
+        )
+
+    def refresh(self, prefix):
+        """
+        List every object under the prefix (paginated) and replace the cached entries for it.
+        Concurrent refreshes of the same prefix share one listing.
+        """
+        return self._refresh_flight.do(prefix, self._list_prefix, prefix)
+
+    def _list_prefix(self, prefix):
+        objects = {}
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                objects[obj["Key"]] = {
+                    "etag": obj["ETag"].strip('"'),
+                    "size": obj["Size"],
+                    "last_modified": obj["LastModified"],
+                }
+
+        with self._lock:
+            for key in [k for k in self._objects if k.startswith(prefix)]:
+                del self._objects[key]
+            self._objects.update(objects)
+            self._listed_prefixes[prefix] = time.monotonic()
+
+        print(f"Indexed {len(objects)} object(s) under s3://{self.bucket_name}/{prefix}")
+        return objects
+
+    def _ensure_listed(self, key):
+        """List the key's prefix if it was never listed or the listing is older than the TTL."""
+        with self._lock:
+            fresh = self._is_fresh(key)
+        if not fresh:
+            self.refresh(self._prefix_for(key))
+
+    def get(self, key):
+        """
+        Return {"etag", "size", "last_modified"} for the key, or None if it does not exist.
+        Listings are trusted for ttl_seconds, so an object written by another process can
+        take up to that long to show up (call invalidate() to see it sooner).
+        """
+        if not key.strip("/"):
+            return None
+        self._ensure_listed(key)
+        with self._lock:
+            return self._objects.get(key)
+
+    def exists(self, key):
+        return self.get(key) is not None
+
+    def list_keys(self, prefix):
+        self._ensure_listed(prefix)
+        with self._lock:
+            return sorted(k for k in self._objects if k.startswith(prefix))
+
+    def find_pdf(self, company_name, year, quarter, category):
+        """
+        Find the PDF for a company/year/quarter/category.
+        If the folder holds more than one PDF (e.g. a corrected re-upload), the newest one wins.
+        """
+        company = company_name.strip().upper()
+        year = year.strip().upper()
+        quarter = quarter.strip().upper()
+        category = category.strip().upper().replace(" ", "_")
+
+        folder = f"{company}/{year}/{quarter}/{category}/"
+        self._ensure_listed(folder)
+        pdf_keys = self._pdf_keys(folder)
+        if not pdf_keys:
+            return None
+
+        with self._lock:
+            newest = max(pdf_keys, key=lambda k: self._objects[k]["last_modified"])
+        if len(pdf_keys) > 1:
+            print(f"Found {len(pdf_keys)} PDFs under s3://{self.bucket_name}/{folder}, using newest: {newest}")
+        return newest
+
+    def _pdf_keys(self, folder):
+        with self._lock:
+            return [k for k in self._objects if k.startswith(folder) and k.lower().endswith(".pdf")]
+
+    def record_write(self, key, size=None, etag=None):
+        """Update the index after uploading an object, without another round trip."""
+        with self._lock:
+            self._objects[key] = {"etag": etag, "size": size, "last_modified": datetime.now(timezone.utc)}
+
+    def invalidate(self, prefix=""):
+        """Forget cached listings under the prefix; the next lookup lists it again."""
+        with self._lock:
+            for key in [k for k in self._objects if k.startswith(prefix)]:
+                del self._objects[key]
+            self._listed_prefixes = {
+                p: listed_at for p, listed_at in self._listed_prefixes.items() if not p.startswith(prefix)
+            }
@@ -3,25 +3,32 @@ import json
 from utils.save_json import save_to_file
 
 
-def final_json(board_data_map, investor_data_map, company_name ):
+def final_json(board_data_map, investor_data_map, company_name, quarter=None):
     # Step 7: Merge and save final combined JSON
+    # quarter: when the maps hold a single known quarter, use it instead of reading it from the filenames
 
     final_output_dir = f"outputs/final_jsons/{company_name}"
     os.makedirs(final_output_dir, exist_ok=True)
     combined_files = []
+    known_quarter = quarter.strip().upper() if quarter else None
     for board_filename, board_response in board_data_map.items():
         try:
-            quarter = None
-            for q in ["Q1", "Q2", "Q3", "Q4"]:
-                if q.lower() in board_filename.lower():
-                    quarter = q
-                    break
-            if not quarter:
-                continue
+            if known_quarter:
+                quarter = known_quarter
+                matching_investor_file = next(iter(investor_data_map), None)
+            else:
+                quarter = None
+                for q in ["Q1", "Q2", "Q3", "Q4"]:
+                    if q.lower() in board_filename.lower():
+                        quarter = q
+                        break
+                if not quarter:
+                    print(f"No quarter found in filename, skipping: {board_filename}")
+                    continue
 
-            matching_investor_file = next(
-                (inv_file for inv_file in investor_data_map if quarter.lower() in inv_file.lower()), None
-            )
+                matching_investor_file = next(
+                    (inv_file for inv_file in investor_data_map if quarter.lower() in inv_file.lower()), None
+                )
             investor_response = investor_data_map.get(matching_investor_file, {})
 
             if isinstance(board_response, str):
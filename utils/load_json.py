@@ -1,10 +1,12 @@
 import json
 import os
 from typing import Union, List
+from utils.page_store import PageStore
 
 def load_json(path: Union[str, List[str]]) -> Union[dict, list, List[Union[dict, list]]]:
     """
     Load JSON from a single file path or list of file paths.
+    .jsonl page files (see utils.page_store) are returned as a list of pages.
 
     Returns:
     - dict or list (for single file)
@@ -13,7 +15,10 @@ def load_json(path: Union[str, List[str]]) -> Union[dict, list, List[Union[dict,
     """
 
     if isinstance(path, str):
-        if os.path.exists(path) and path.endswith(".json"):
+        if os.path.exists(path) and path.endswith(".jsonl"):
+            with PageStore(path) as store:
+                return store.read_all()
+        elif os.path.exists(path) and path.endswith(".json"):
             with open(path, "r", encoding="utf-8") as f:
                 return json.load(f)
         else:
@@ -23,7 +28,10 @@ def load_json(path: Union[str, List[str]]) -> Union[dict, list, List[Union[dict,
     elif isinstance(path, list):
         loaded = []
         for p in path:
-            if os.path.exists(p) and p.endswith(".json"):
+            if os.path.exists(p) and p.endswith(".jsonl"):
+                with PageStore(p) as store:
+                    loaded.append(store.read_all())
+            elif os.path.exists(p) and p.endswith(".json"):
                 with open(p, "r", encoding="utf-8") as f:
                     loaded.append(json.load(f))
             else:
@@ -0,0 +1,225 @@
+import os
+import re
+import json
+import mmap
+from typing import Iterator, List, Optional
+
+
+INDEX_SUFFIX = ".idx"
+# Words too common to say anything about which page a term is on
+STOP_WORDS = {"and", "the", "for", "from", "per", "with", "total", "other"}
+
+
+def _index_path(path: str) -> str:
+    return path + INDEX_SUFFIX
+
+
+def save_pages(pages: List[dict], path: str) -> str:
+    """
+    Save page chunks as compact JSONL (one page per line) plus an offset index.
+
+    The index file (<path>.idx) holds [page_no, offset, length] for every line
+    so a single page can be read without parsing the whole document.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    index = []
+    with open(path, "wb") as f:
+        for page in pages:
+            line = json.dumps(page, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+            index.append([str(page.get("page_no")), f.tell(), len(line)])
+            f.write(line)
+
+    with open(_index_path(path), "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+
+    return path
+
+
+def build_index(path: str) -> list:
+    """Rebuild the offset index of a JSONL page file (e.g. after downloading it from S3)."""
+    index = []
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                page = json.loads(line)
+                index.append([str(page.get("page_no")), offset, len(line)])
+            offset += len(line)
+
+    with open(_index_path(path), "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+
+    return index
+
+
+def convert_json_to_pages(json_path: str, jsonl_path: Optional[str] = None) -> str:
+    """Convert a legacy pretty-printed .json page list into the JSONL page format."""
+    jsonl_path = jsonl_path or os.path.splitext(json_path)[0] + ".jsonl"
+    with open(json_path, "r", encoding="utf-8") as f:
+        pages = json.load(f)
+    return save_pages(pages, jsonl_path)
+
+
+class PageStore:
+    """
+    Read access to extracted page chunks.
+
+    - .jsonl files are read lazily through the offset index (optionally memory-mapped).
+    - Legacy .json files are loaded whole, so existing extraction output keeps working.
+    """
+
+    def __init__(self, path: str, use_mmap: bool = False):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"File not found: {path}")
+
+        self.path = path
+        self.use_mmap = use_mmap
+        self._legacy_pages = None
+        self._index = None
+        self._offsets = {}
+        self._mmap = None
+        self._file = None
+
+        if path.endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                self._legacy_pages = json.load(f)
+        else:
+            index_path = _index_path(path)
+            if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+                with open(index_path, "r", encoding="utf-8") as f:
+                    self._index = json.load(f)
+            else:
+                self._index = build_index(path)
+            self._offsets = {page_no: (offset, length) for page_no, offset, length in self._index}
+
+    def __len__(self):
+        if self._legacy_pages is not None:
+            return len(self._legacy_pages)
+        return len(self._index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def page_numbers(self) -> List[str]:
+        if self._legacy_pages is not None:
+            return [str(page.get("page_no")) for page in self._legacy_pages]
+        return [entry[0] for entry in self._index]
+
+    def _read_line(self, offset: int, length: int) -> dict:
+        if self.use_mmap:
+            if self._mmap is None:
+                self._file = open(self.path, "rb")
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            return json.loads(self._mmap[offset:offset + length])
+
+        if self._file is None:
+            self._file = open(self.path, "rb")
+        self._file.seek(offset)
+        return json.loads(self._file.read(length))
+
+    def get_page(self, page_no) -> Optional[dict]:
+        """Return a single page by its page_no, or None if it is not in the document."""
+        page_no = str(page_no)
+        if self._legacy_pages is not None:
+            return next((page for page in self._legacy_pages if str(page.get("page_no")) == page_no), None)
+
+        entry = self._offsets.get(page_no)
+        if entry is None:
+            return None
+        return self._read_line(*entry)
+
+    def iter_pages(self, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[dict]:
+        """Yield pages whose page_no falls within [start, end] (both inclusive, either optional)."""
+        def in_range(page_no):
+            try:
+                page_no = int(page_no)
+            except (TypeError, ValueError):
+                return start is None and end is None
+            return (start is None or page_no >= start) and (end is None or page_no <= end)
+
+        if self._legacy_pages is not None:
+            for page in self._legacy_pages:
+                if in_range(page.get("page_no")):
+                    yield page
+            return
+
+        for page_no, offset, length in self._index:
+            if in_range(page_no):
+                yield self._read_line(offset, length)
+
+    def stream(self) -> Iterator[dict]:
+        """Yield every page in order, reading the file sequentially."""
+        if self._legacy_pages is not None:
+            yield from self._legacy_pages
+            return
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def read_all(self) -> List[dict]:
+        return list(self.stream())
+
+
+def load_pages(path: str, start: Optional[int] = None, end: Optional[int] = None,
+               keywords: Optional[List[str]] = None) -> List[dict]:
+    """
+    Load only the pages needed for a prompt.
+
+    - start / end: page range (inclusive)
+    - keywords: keep pages whose content mentions any of the keywords
+      (falls back to the whole range if nothing matches). Keywords derived from a
+      query make the page set query-specific, so don't use them with the
+      prefix_cache prompt layout.
+    """
+    with PageStore(path) as store:
+        if start is None and end is None:
+            pages = store.read_all()
+        else:
+            pages = list(store.iter_pages(start, end))
+
+    if keywords:
+        lowered = [k.lower() for k in keywords if k]
+        matched = [page for page in pages if any(k in page.get("content", "").lower() for k in lowered)]
+        if matched:
+            return matched
+
+    return pages
+
+
+def query_keywords(table_name: Optional[str], terms) -> List[str]:
+    """
+    Keywords for picking the pages relevant to a query: the words of each term
+    (e.g. "Cement_sale_volume" -> cement, sale, volume) plus the results table title.
+    terms may be a comma separated string, a JSON object/list or a list.
+    """
+    if isinstance(terms, str):
+        try:
+            terms = json.loads(terms)
+        except ValueError:
+            terms = terms.split(",")
+    if isinstance(terms, dict):
+        terms = list(terms.keys())
+
+    keywords = []
+    for term in terms:
+        for word in re.split(r"[\s_\-/,()]+", str(term).lower()):
+            if len(word) >= 3 and word not in STOP_WORDS and word not in keywords:
+                keywords.append(word)
+
+    if table_name:
+        keywords.append(f"{table_name.strip().lower()} financial results")
+    return keywords
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key.
+
+    The first caller for a key runs the function; callers that arrive while it is
+    still running wait for it and get the same result (or the same exception).
+    Nothing is cached once the call finishes.
+    """
+
+    def __init__(self, name="single-flight"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            print(f"[{self.name}] Attaching to in-flight work for {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                print(f"[{self.name}] Shared result for {key} with {call.waiters} waiting caller(s)")
+
+    def in_flight(self, key) -> bool:
+        with self._lock:
+            return key in self._calls
+
+
+class AsyncSingleFlight:
+    """
+    Event-loop version of SingleFlight for async endpoints.
+
+    The first caller for a key starts a task; later callers await the same task,
+    so waiting costs no thread. Callers that go away (e.g. a disconnected client)
+    don't cancel the shared task.
+    """
+
+    def __init__(self, name="single-flight"):
+        self.name = name
+        self._tasks = {}
+
+    async def do(self, key, coro_fn, *args, **kwargs):
+        task = self._tasks.get(key)
+        if task is not None:
+            print(f"[{self.name}] Attaching to in-flight work for {key}")
+        else:
+            task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            self._tasks[key] = task
+
+            def _forget(done_task):
+                if self._tasks.get(key) is done_task:
+                    del self._tasks[key]
+                if not done_task.cancelled():
+                    done_task.exception()  # Mark as retrieved even if every caller went away
+
+            task.add_done_callback(_forget)
+
+        return await asyncio.shield(task)
+
+    def in_flight(self, key) -> bool:
+        return key in self._tasks